@@ -2,9 +2,14 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import os
+import html
 import plotly.express as px
 import plotly.graph_objects as go
+from matplotlib import colormaps
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from datetime import datetime
+from workbook_cache import read_sidecars, workbook_version, write_sidecars
 
 # ─────────────────────────────────────────────
 # CONSTANTS
@@ -15,6 +20,13 @@ SHEET_METADATA    = "metadata"
 SHEET_ROLLING_12M = "rolling_12m"
 SHEET_MONTHLY     = "monthly_returns"
 SHEET_QUARTERLY   = "quarterly_returns"
+BOOK_SHEETS       = (SHEET_PRICES, SHEET_ROLLING_12M, SHEET_METADATA)   # monthly/quarterly are recomputed from prices
+
+PRICE_DTYPE  = np.float32
+TICKER_DTYPE = "string[pyarrow]"
+
+MAX_CHART_POINTS     = 1000
+MONTHLY_ROWS_DEFAULT = 24   # latest months shown in the Tab 3 heatmap before the user asks for more
 
 BRAND_DARK  = "#002b5b"
 BRAND_MID   = "#004080"
@@ -97,6 +109,24 @@ th {{
     font-family: 'DM Sans', sans-serif !important;
 }}
 td {{ text-align: center !important; }}
+
+.heatmap-table {{
+    overflow: auto;
+    max-height: 560px;
+    border: 1px solid #e6ecf5;
+    border-radius: 8px;
+}}
+.heatmap-table table {{
+    border-collapse: collapse;
+    width: 100%;
+    font-family: 'DM Mono', monospace;
+    font-size: 0.78em;
+}}
+.heatmap-table th, .heatmap-table td {{
+    padding: 4px 8px;
+    white-space: nowrap;
+}}
+.heatmap-table thead th {{ position: sticky; top: 0; }}
 </style>
 """, unsafe_allow_html=True)
 
@@ -104,85 +134,332 @@ td {{ text-align: center !important; }}
 # ─────────────────────────────────────────────
 # CACHED DATA LOADERS
 # ─────────────────────────────────────────────
-@st.cache_data(show_spinner="Loading price data…")
-def load_prices(file_path: str) -> pd.DataFrame:
-    """Returns RAW prices with original ticker columns — never rename in-place here."""
-    df = pd.read_excel(file_path, sheet_name=SHEET_PRICES, index_col=0)
-    df.index = pd.to_datetime(df.index)
-    return df
+# The st.cache_resource loaders (load_prices, load_named_prices, load_daily_returns)
+# hand every rerun and session the same frame instead of an unpickled copy, so callers
+# must treat what they return as read-only.
+def downcast_floats(df: pd.DataFrame) -> pd.DataFrame:
+    """Casts numeric columns to PRICE_DTYPE; any text column is left untouched."""
+    return df.astype({c: PRICE_DTYPE for c in df.select_dtypes("number").columns})
+
+def apply_name_map(df: pd.DataFrame, name_map: dict) -> pd.DataFrame:
+    return df.rename(columns=name_map)
+
+def open_workbook(file_path: str) -> pd.ExcelFile:
+    """Opens the xlsx with the Rust calamine reader, falling back to openpyxl if it isn't installed."""
+    try:
+        return pd.ExcelFile(file_path, engine="calamine")
+    except ImportError:
+        return pd.ExcelFile(file_path, engine="openpyxl")
 
 @st.cache_data(show_spinner=False)
-def load_name_map(file_path: str) -> dict:
+def list_workbooks(folder: str, mtime: float) -> list[str]:
+    """Sorted .xlsx names in folder; keyed on the folder's mtime, which changes whenever
+    a workbook is added, removed or renamed."""
+    return sorted(f for f in os.listdir(folder) if f.endswith(".xlsx"))
+
+@st.cache_data(show_spinner="Loading price data…")
+def load_book(file_path: str, version: str) -> dict[str, pd.DataFrame]:
+    """The BOOK_SHEETS present in the workbook, parsed from a single open handle.
+
+    The first load of a workbook version also writes Parquet sidecars (see
+    workbook_cache); later processes read those instead of parsing the xlsx.
+    """
+    book = read_sidecars(file_path, version)
+    if book is not None:
+        return book
+    with open_workbook(file_path) as xl:
+        # Text sheets come back Arrow-backed; numeric sheets stay NumPy so the
+        # float32 kernels below can work on them without conversion.
+        book = {
+            name: (
+                xl.parse(name, index_col=0, dtype_backend="pyarrow")
+                if name == SHEET_METADATA else
+                xl.parse(name, index_col=0, parse_dates=True)
+            )
+            for name in BOOK_SHEETS
+            if name in xl.sheet_names
+        }
     try:
-        meta = pd.read_excel(file_path, sheet_name=SHEET_METADATA, index_col=0)
-        return meta.iloc[:, 0].to_dict()
+        write_sidecars(file_path, version, book)
     except Exception:
+        pass   # sidecars are only a cache (read-only folder, unserialisable sheet) — serve the xlsx frames
+    return book
+
+@st.cache_resource(show_spinner=False)
+def load_prices(file_path: str, version: str) -> pd.DataFrame:
+    """Returns RAW prices with original ticker columns — never rename in-place here."""
+    df = load_book(file_path, version)[SHEET_PRICES]
+    df.columns = pd.Index(df.columns, dtype=TICKER_DTYPE)
+    return downcast_floats(df)   # float32 once, so every downstream pass moves half the bytes
+
+@st.cache_data(show_spinner=False)
+def load_name_map(file_path: str, version: str) -> dict:
+    """Ticker → display name from the metadata sheet, or {} if the workbook lacks it."""
+    meta = load_book(file_path, version).get(SHEET_METADATA)
+    if meta is None:
         return {}
+    return meta.iloc[:, 0].to_dict()
+
+@st.cache_resource(show_spinner=False)
+def load_named_prices(file_path: str, version: str) -> pd.DataFrame:
+    """load_prices() with display-name columns, renamed once per file version."""
+    return apply_name_map(load_prices(file_path, version), load_name_map(file_path, version))
 
 @st.cache_data(show_spinner=False)
-def load_sheet(file_path: str, sheet: str) -> pd.DataFrame | None:
-    try:
-        return pd.read_excel(file_path, sheet_name=sheet, index_col=0)
-    except Exception:
+def load_sheet(file_path: str, version: str, sheet: str) -> pd.DataFrame | None:
+    """A float32 sheet with display-name columns, or None if the workbook lacks it."""
+    df = load_book(file_path, version).get(sheet)
+    if df is None:
         return None
+    return apply_name_map(downcast_floats(df), load_name_map(file_path, version))
 
-def apply_name_map(df: pd.DataFrame, name_map: dict) -> pd.DataFrame:
-    return df.rename(columns=name_map)
+@st.cache_data(show_spinner=False)
+def load_period_returns(file_path: str, version: str, freq: str) -> pd.DataFrame:
+    """% change between period-end closes ("ME" / "QE"), newest first — the same numbers
+    the engine writes to the monthly/quarterly sheets, derived from the cached prices."""
+    closes = load_named_prices(file_path, version).resample(freq).last()
+    return (closes.pct_change() * 100).sort_index(ascending=False)
+
+@st.cache_data(show_spinner=False)
+def load_quarterly(file_path: str, version: str) -> pd.DataFrame:
+    """Quarterly returns re-indexed to quarter-start timestamps."""
+    df = load_period_returns(file_path, version, "QE")
+    df.index = df.index.to_period("Q").to_timestamp()
+    return df
+
+@st.cache_data(show_spinner=False)
+def load_stock_list(file_path: str, version: str) -> list[str]:
+    """Sorted display names of every ticker in the prices sheet."""
+    return sorted(load_named_prices(file_path, version).columns)
+
+@st.cache_data(show_spinner=False)
+def load_calendar(file_path: str, version: str) -> tuple[list[int], np.ndarray, np.ndarray]:
+    """Distinct years and YYYYMM month codes (newest first), plus the per-row year array
+    of the prices sheet so filters never recompute DatetimeIndex.year."""
+    idx       = load_prices(file_path, version).index
+    row_years = idx.year.to_numpy(np.int32)
+    codes     = np.unique(row_years * 100 + idx.month.to_numpy(np.int32))[::-1]
+    years     = np.unique(codes // 100)[::-1].tolist()
+    return years, codes, row_years
+
+@st.cache_data(show_spinner=False)
+def load_date_labels(file_path: str, version: str) -> pd.DataFrame:
+    """Display strings for every price date, formatted once per file version."""
+    idx = load_prices(file_path, version).index
+    return pd.DataFrame({
+        "ym":    idx.year * 100 + idx.month,   # YYYYMM code, matches load_calendar()
+        "date":  idx.strftime("%Y-%m-%d"),
+        "day":   idx.strftime("%Y-%m-%d (%a)"),
+    }, index=idx)
 
 @st.cache_data(show_spinner=False)
-def compute_corr(_df: pd.DataFrame) -> pd.DataFrame:
-    return _df.pct_change().dropna().corr()
+def load_moving_averages(file_path: str, version: str, ticker: str) -> pd.DataFrame:
+    """50/200 DMA and all-time drawdown over the full price history of one (display-named)
+    ticker, so switching the deep-dive stock back and forth recomputes nothing."""
+    series = load_named_prices(file_path, version)[ticker].dropna()
+    values = series.to_numpy(np.float64)
+    return pd.DataFrame({
+        "ma50":     rolling_mean(values, 50),
+        "ma200":    rolling_mean(values, 200),
+        "drawdown": drawdown_pct(series),
+    }, index=series.index)
+
+@st.cache_resource(show_spinner=False)
+def load_daily_returns(file_path: str, version: str) -> pd.DataFrame:
+    """Full-history daily % returns with display names — computed once per file version."""
+    return daily_returns(load_named_prices(file_path, version))
+
+@st.cache_data(show_spinner=False)
+def csv_bytes(df: pd.DataFrame) -> bytes:
+    """UTF-8 CSV for a download button — serialised once per distinct frame, not per rerun.
+
+    Written by Arrow's C++ CSV writer: daily timestamps go out as plain dates and NaN
+    as an empty field. Unlike DataFrame.to_csv(), headers and text cells are quoted and
+    whole floats drop the trailing ".0".
+    """
+    index = df.index.to_numpy()
+    if isinstance(df.index, pd.DatetimeIndex) and (df.index == df.index.normalize()).all():
+        index = index.astype("datetime64[D]")
+    # Positional columns and an explicit name list, so duplicate labels (or one equal to
+    # the index name) stay separate columns.
+    arrays = [pa.array(index, from_pandas=True)]
+    arrays += [pa.array(df.iloc[:, i].to_numpy(), from_pandas=True) for i in range(df.shape[1])]
+    names  = [str(df.index.name or ""), *map(str, df.columns)]
+    table  = pa.Table.from_arrays(arrays, names=names)
+    buf = pa.BufferOutputStream()
+    pacsv.write_csv(table, buf)
+    return buf.getvalue().to_pybytes()
+
+@st.cache_data(show_spinner=False)
+def returns_heatmap_html(df: pd.DataFrame) -> str:
+    """Shared red-to-green % heatmap, rendered to HTML once per distinct table.
+
+    Same colouring as Styler.background_gradient(cmap="RdYlGn", axis=None), with the
+    whole colour matrix from one vectorised colormap call; empty cells are left unshaded.
+    """
+    values = df.to_numpy(np.float64)
+    valid  = ~np.isnan(values)
+    lo, hi = (np.nanmin(values), np.nanmax(values)) if valid.any() else (0.0, 0.0)
+    scaled = (values - lo) / (hi - lo) if hi > lo else np.zeros_like(values)
+    rgb    = colormaps["RdYlGn"](np.nan_to_num(scaled))[..., :3]
+
+    # Light text on dark cells — Styler's relative-luminance rule and 0.408 threshold.
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    dark   = linear @ np.array([0.2126, 0.7152, 0.0722]) < 0.408
+    rgb8   = np.round(rgb * 255).astype(np.int64)
+
+    def cell(r: int, c: int) -> str:
+        if not valid[r, c]:
+            return "<td>—</td>"
+        red, green, blue = rgb8[r, c]
+        text = "#f1f1f1" if dark[r, c] else "#000000"
+        return (f'<td style="background-color: #{red:02x}{green:02x}{blue:02x}; color: {text}">'
+                f"{values[r, c]:.2f}%</td>")
+
+    corner = html.escape(str(df.index.name or ""))
+    head   = "".join(f"<th>{html.escape(str(c))}</th>" for c in df.columns)
+    body   = "".join(
+        f"<tr><th>{html.escape(str(label))}</th>{''.join(cell(r, c) for c in range(values.shape[1]))}</tr>"
+        for r, label in enumerate(df.index)
+    )
+    return f"<table><thead><tr><th>{corner}</th>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+def render_heatmap(df: pd.DataFrame) -> None:
+    st.html(f'<div class="heatmap-table">{returns_heatmap_html(df)}</div>')
+
+@st.cache_data(show_spinner=False)
+def compute_corr(df: pd.DataFrame) -> pd.DataFrame:
+    return daily_returns(df).dropna().corr()
 
 
 # ─────────────────────────────────────────────
 # HELPERS
 # ─────────────────────────────────────────────
+def daily_returns(df: pd.DataFrame) -> pd.DataFrame:
+    """Row-over-row % change, computed on the raw float32 array (first row NaN)."""
+    values = df.to_numpy()
+    out    = np.full_like(values, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(values[1:], values[:-1], out=out[1:])
+    out[1:] -= 1
+    out[1:] *= 100
+    return pd.DataFrame(out, index=df.index, columns=df.columns)
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean from a running sum (add newest, drop oldest); NaN until the window fills."""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        csum = np.cumsum(values)
+        out[window - 1:] = (csum[window - 1:] - np.r_[0.0, csum[:-window]]) / window
+    return out
+
+
+def drawdown_pct(series: pd.Series) -> pd.Series:
+    """% below the running peak, via np.maximum.accumulate on the raw (NaN-free) array."""
+    values = series.to_numpy()
+    return pd.Series((values / np.maximum.accumulate(values) - 1) * 100, index=series.index)
+
+
 def calc_summary(filtered_df: pd.DataFrame) -> pd.DataFrame:
-    rows = []
-    for ticker in filtered_df.columns:
-        col = filtered_df[ticker].dropna()
-        if len(col) < 2:
-            continue
-        daily_ret = col.pct_change().dropna()
-        days  = (col.index[-1] - col.index[0]).days
-        yrs   = max(days / 365.25, 0.1)
-        ret   = ((col.iloc[-1] / col.iloc[0]) - 1) * 100
-        cagr  = (((col.iloc[-1] / col.iloc[0]) ** (1 / yrs)) - 1) * 100
-        vol   = daily_ret.std() * np.sqrt(252) * 100 if len(daily_ret) > 1 else np.nan
-        sharpe = (cagr / vol) if (not np.isnan(vol) and vol > 0) else np.nan
-        rows.append({
-            "Ticker":      ticker,
-            "Return %":    ret,
-            "CAGR %":      cagr,
-            "Ann. Vol %":  vol,
-            "Sharpe":      sharpe,
-            "Latest":      col.iloc[-1],
-            "_years":      yrs,
-        })
-    return pd.DataFrame(rows).sort_values("Return %", ascending=False)
-
-
-def parse_quarterly_index(raw_index) -> pd.DatetimeIndex:
-    parsed = []
-    for x in raw_index:
-        s = str(x).strip()
-        try:
-            if any(c.isdigit() for c in s) and ("/" in s or (s.count("-") >= 2) or len(s) > 7):
-                ts = pd.to_datetime(s)
-                parsed.append(ts.to_period("Q").to_timestamp())
-                continue
-            s_norm = s.replace("-", "").replace(" ", "")
-            if s_norm[:1] == "Q":
-                q = int(s_norm[1])
-                y = int(s_norm[2:])
-            else:
-                y = int(s_norm[:4])
-                q = int(s_norm[5])
-            month = (q - 1) * 3 + 1
-            parsed.append(pd.Timestamp(year=y, month=month, day=1))
-        except Exception:
-            parsed.append(pd.NaT)
-    return pd.DatetimeIndex(parsed)
+    # First/last valid value of every column from one pass over the NaN mask.
+    values    = filtered_df.to_numpy()
+    valid     = ~np.isnan(values)
+    n_valid   = valid.sum(axis=0)
+    first_pos = valid.argmax(axis=0)
+    last_pos  = len(values) - 1 - valid[::-1].argmax(axis=0)
+    col_pos   = np.arange(values.shape[1])
+    first_px  = values[first_pos, col_pos]
+    last_px   = values[last_pos, col_pos]
+    daily_std = daily_returns(filtered_df).std().to_numpy()
+
+    # Every metric is one array expression across all tickers.
+    dates = filtered_df.index.to_numpy()
+    days  = (dates[last_pos] - dates[first_pos]) / np.timedelta64(1, "D")
+    yrs   = np.maximum(days / 365.25, 0.1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = last_px.astype(np.float64) / first_px   # ** (1 / yrs) wants full precision
+        ret    = (growth - 1) * 100
+        cagr   = (growth ** (1 / yrs) - 1) * 100
+        vol    = daily_std * np.sqrt(252)
+        sharpe = np.where(vol > 0, cagr / vol, np.nan)
+
+    keep    = n_valid >= 2
+    summary = pd.DataFrame({
+        "Ticker":      filtered_df.columns[keep],
+        "Return %":    ret[keep],
+        "CAGR %":      cagr[keep],
+        "Ann. Vol %":  vol[keep],
+        "Sharpe":      sharpe[keep],
+        "Latest":      last_px[keep],
+        "_years":      yrs[keep],
+    })
+    summary["Ticker"] = summary["Ticker"].astype(TICKER_DTYPE)
+    return summary.sort_values("Return %", ascending=False)
+
+
+def lttb_positions(y: np.ndarray, n_out: int = MAX_CHART_POINTS) -> np.ndarray:
+    """Row positions kept by Largest-Triangle-Three-Buckets downsampling (x = row position).
+
+    NaN rows are skipped; the first and last valid points are always kept, and within
+    each bucket the point forming the largest triangle with its neighbours survives,
+    so peaks and troughs stay visible.
+    """
+    pos = np.flatnonzero(~np.isnan(y))
+    if len(pos) <= n_out:
+        return pos
+    x, y  = pos.astype(np.float64), y[pos].astype(np.float64)
+    edges = np.linspace(1, len(pos) - 1, n_out - 1).astype(np.int64)
+    keep  = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, len(pos) - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi  = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else len(pos)
+        cx, cy  = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area    = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a       = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return pos[keep]
+
+
+def thin_series(series: pd.Series, max_points: int = MAX_CHART_POINTS) -> pd.Series:
+    return series.iloc[lttb_positions(series.to_numpy(), max_points)]
+
+
+@st.cache_data(show_spinner=False)
+def line_chart(data: pd.DataFrame, y_title: str = "value", max_points: int = MAX_CHART_POINTS,
+               uirevision: str | None = None) -> go.Figure:
+    """One Scattergl line per column of data, each LTTB-downsampled to ≤ max_points."""
+    fig = go.Figure()
+    for col in data.columns:
+        values = data[col].to_numpy()   # float32 stays float32: plotly ships it as a half-size typed array
+        keep   = lttb_positions(values, max_points)
+        fig.add_trace(go.Scattergl(x=data.index[keep], y=values[keep], mode="lines", name=str(col)))
+    return fig.update_layout(
+        template="plotly_white",
+        xaxis_title=data.index.name or "index",
+        yaxis_title=y_title,
+        legend_title_text="variable",
+        uirevision=uirevision,   # fixed per file, so plotly.js keeps zoom/legend state across reruns
+    )
+
+
+@st.cache_data(show_spinner=False)
+def ranking_chart(summary: pd.DataFrame) -> go.Figure:
+    """Horizontal Return % bars in the summary's (already ranked) order, green up / red down."""
+    bar_df = summary.assign(
+        Direction=np.where(summary["Return %"] >= 0, "Positive ▲", "Negative ▼"),
+    )
+    fig = px.bar(
+        bar_df, x="Return %", y="Ticker", orientation="h",
+        color="Direction",
+        color_discrete_map={"Positive ▲": "#2ecc71", "Negative ▼": "#e74c3c"},
+        # The summary is already ranked — pin that order so plotly doesn't re-sort the axis.
+        category_orders={"Ticker": summary["Ticker"].tolist()},
+        template="plotly_white",
+    )
+    return fig.update_layout(showlegend=True, legend_title_text="")
 
 
 def non_contiguous_years(years: list) -> bool:
@@ -203,7 +480,7 @@ if not os.path.exists(FOLDER):
     st.error(f"🚨 Folder '{FOLDER}' not found. Please run your engine script first.")
     st.stop()
 
-files = sorted([f for f in os.listdir(FOLDER) if f.endswith(".xlsx")])
+files = list_workbooks(FOLDER, os.path.getmtime(FOLDER))
 if not files:
     st.error("🚨 No .xlsx files found in the dashboards folder.")
     st.stop()
@@ -219,7 +496,6 @@ with st.sidebar:
     # st.rerun() inside on_change is a no-op in Streamlit — the flag approach is the correct pattern.
     def _on_file_change():
         """Set a flag; the main script body will call st.rerun() after this callback returns."""
-        st.cache_data.clear()
         st.session_state["_needs_rerun"] = True
 
     selected_file = st.selectbox(
@@ -227,7 +503,9 @@ with st.sidebar:
         key="main_file_select",
         on_change=_on_file_change,
     )
-    file_path = os.path.join(FOLDER, selected_file)
+    file_path  = os.path.join(FOLDER, selected_file)
+    file_mtime   = os.path.getmtime(file_path)   # only shown as the sync time
+    file_version = workbook_version(file_path)   # part of every loader's cache key
 
     if st.button(
         "🔄 Refresh Price Data",
@@ -236,27 +514,29 @@ with st.sidebar:
         help="Use this ONLY after running your engine to pull fresh market data. Switching watchlists above is fully automatic — no refresh needed.",
     ):
         st.cache_data.clear()
+        st.cache_resource.clear()
         st.rerun()
 
-    name_map  = load_name_map(file_path)
-    _raw_prices = load_prices(file_path)
-    prices_df   = apply_name_map(_raw_prices, name_map)
-    all_stocks  = sorted(prices_df.columns.tolist())
+    prices_df   = load_named_prices(file_path, file_version)
+    all_stocks  = load_stock_list(file_path, file_version)
 
     st.markdown("---")
 
-    select_all      = st.toggle("Select All Stocks", value=True)
-    current_default = all_stocks if select_all else []
-    selected_stocks = st.multiselect(
-        "Active Stocks",
-        all_stocks,
-        default=current_default,
-        key=f"stocks_{select_all}",
-    )
+    # The stock selection lives in session_state and is only rewritten when the file or
+    # the toggle changes.
+    def _on_select_all_change():
+        st.session_state["selected_stocks"] = list(all_stocks) if st.session_state["select_all"] else []
+
+    if st.session_state.get("_stocks_source") != (file_path, file_version):
+        st.session_state["selected_stocks"] = list(all_stocks) if st.session_state.get("select_all", True) else []
+        st.session_state["_stocks_source"]  = (file_path, file_version)
+
+    st.toggle("Select All Stocks", value=True, key="select_all", on_change=_on_select_all_change)
+    selected_stocks = st.multiselect("Active Stocks", all_stocks, key="selected_stocks")
     if selected_stocks:
         st.caption(f"✅ {len(selected_stocks)} of {len(all_stocks)} stocks selected")
 
-    available_years = sorted(prices_df.index.year.unique(), reverse=True)
+    available_years, month_codes, row_years = load_calendar(file_path, file_version)
     selected_years  = st.multiselect("Years", available_years, default=available_years[:2])
 
     if len(selected_years) > 1 and non_contiguous_years(selected_years):
@@ -296,7 +576,18 @@ if not selected_stocks:
     st.warning("⚠️ Please select at least one stock.")
     st.stop()
 
-filtered_prices = prices_df[prices_df.index.year.isin(selected_years)][selected_stocks]
+year_mask = np.isin(row_years, selected_years)
+
+# Re-slice only when the file or the year/stock filters change — tab-level widget
+# interactions and benchmark edits reuse the session's copy.
+filter_key = (file_path, file_version, tuple(sorted(selected_years)), tuple(selected_stocks))
+if st.session_state.get("_filter_key") != filter_key:
+    # One positional take over the selected rows and columns.
+    st.session_state["_filtered_prices"] = prices_df.iloc[
+        np.flatnonzero(year_mask), prices_df.columns.get_indexer(selected_stocks)
+    ]
+    st.session_state["_filter_key"]      = filter_key
+filtered_prices = st.session_state["_filtered_prices"]
 
 if filtered_prices.empty:
     st.warning("⚠️ No data for the selected filters.")
@@ -316,7 +607,7 @@ avg_years = df_sum["_years"].mean()
 # ─────────────────────────────────────────────
 st.markdown(f'<h1 class="main-header">📈 {selected_file.replace(".xlsx", "")}</h1>', unsafe_allow_html=True)
 
-sync_time = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d %H:%M")
+sync_time = datetime.fromtimestamp(file_mtime).strftime("%Y-%m-%d %H:%M")
 
 c1, c2, c3 = st.columns(3)
 with c1:
@@ -380,23 +671,14 @@ with t1:
 
     with v1:
         st.subheader("🔥 Performance Ranking")
-        bar_df = df_sum.copy()
-        bar_df["Direction"] = bar_df["Return %"].apply(lambda x: "Positive ▲" if x >= 0 else "Negative ▼")
-        fig_bar = px.bar(
-            bar_df, x="Return %", y="Ticker", orientation="h",
-            color="Direction",
-            color_discrete_map={"Positive ▲": "#2ecc71", "Negative ▼": "#e74c3c"},
-            template="plotly_white",
-        )
-        fig_bar.update_layout(showlegend=True, legend_title_text="")
-        st.plotly_chart(fig_bar, use_container_width=True)
+        st.plotly_chart(ranking_chart(df_sum[["Ticker", "Return %"]]), use_container_width=True)
 
     with v2:
         st.subheader("📈 Relative Price Movement")
-        fig_price = px.line(filtered_prices, template="plotly_white")
+        fig_price = line_chart(filtered_prices, uirevision=file_path)
         if benchmark and benchmark in prices_df.columns:
-            bm_series = prices_df[benchmark][prices_df.index.year.isin(selected_years)]
-            fig_price.add_trace(go.Scatter(
+            bm_series = thin_series(prices_df.loc[year_mask, benchmark])
+            fig_price.add_trace(go.Scattergl(
                 x=bm_series.index, y=bm_series,
                 name=f"📌 {benchmark}",
                 line=dict(color="black", width=2, dash="dot"),
@@ -411,15 +693,17 @@ with t1:
         "regardless of its actual price. A value of 115 means +15% from your entry; 87 means −13%. "
         "This removes price-level bias and lets you fairly compare stocks trading at very different absolute prices (e.g. ₹50 vs ₹5,000)."
     )
-    first_valid = filtered_prices.apply(lambda c: c.dropna().iloc[0] if c.dropna().shape[0] else None)
+    # First non-NaN price of every column via one argmax over the NaN mask.
+    values      = filtered_prices.to_numpy()
+    first_valid = values[(~np.isnan(values)).argmax(axis=0), np.arange(values.shape[1])]
     norm        = filtered_prices.div(first_valid) * 100
-    fig_norm    = px.line(norm, template="plotly_white", labels={"value": "Rebased Price (100 = start)"})
+    fig_norm    = line_chart(norm, "Rebased Price (100 = start)", uirevision=file_path)
 
     if benchmark and benchmark in prices_df.columns:
-        bm_series = prices_df[benchmark][prices_df.index.year.isin(selected_years)].dropna()
+        bm_series = prices_df.loc[year_mask, benchmark].dropna()
         if not bm_series.empty:
-            bm_norm = bm_series / bm_series.iloc[0] * 100
-            fig_norm.add_trace(go.Scatter(
+            bm_norm = thin_series(bm_series / bm_series.iloc[0] * 100)
+            fig_norm.add_trace(go.Scattergl(
                 x=bm_norm.index, y=bm_norm,
                 name=f"📌 {benchmark}",
                 line=dict(color="black", width=2, dash="dot"),
@@ -429,15 +713,12 @@ with t1:
     st.divider()
 
     st.subheader("🕵️ Rolling 12M Return Consistency")
-    roll_raw = load_sheet(file_path, SHEET_ROLLING_12M)
+    roll_raw = load_sheet(file_path, file_version, SHEET_ROLLING_12M)
     if roll_raw is not None:
-        roll_raw.index = pd.to_datetime(roll_raw.index)
-        roll_raw = apply_name_map(roll_raw, name_map)
         cols_avail = [c for c in selected_stocks if c in roll_raw.columns]
         if cols_avail:
             display_roll = roll_raw[cols_avail]
-            fig_roll = px.line(display_roll, template="plotly_white",
-                               labels={"value": "12M Rolling Return (%)"})
+            fig_roll = line_chart(display_roll, "12M Rolling Return (%)", uirevision=file_path)
             fig_roll.add_hline(
                 y=0, line_dash="dash", line_color="red",
                 annotation_text="Breakeven (0%)",
@@ -495,24 +776,22 @@ with t2:
 # ══════════════════════════════════════════════
 # TAB 3 — MONTHLY HEATMAP
 # ══════════════════════════════════════════════
-with t3:
+@st.fragment
+def render_monthly_tab():
+    """The row-count slider reruns only this tab."""
     st.subheader("Monthly Returns (%)")
-    m_data = load_sheet(file_path, SHEET_MONTHLY)
-    if m_data is not None:
-        m_data = apply_name_map(m_data, name_map)
-        m_data.index = pd.to_datetime(m_data.index)
-        cols_avail = [c for c in selected_stocks if c in m_data.columns]
-        if cols_avail:
-            f_m = m_data[m_data.index.year.isin(selected_years)][cols_avail].sort_index(ascending=False)
-            f_m.index = f_m.index.strftime("%Y-%b")
-            st.dataframe(
-                f_m.style.background_gradient(cmap="RdYlGn", axis=None).format("{:.2f}%"),
-                use_container_width=True,
-            )
-        else:
-            st.info("ℹ️ No matching tickers in monthly_returns sheet.")
-    else:
-        st.info("ℹ️ Monthly data not found.")
+    m_data = load_period_returns(file_path, file_version, "ME")
+    f_m    = m_data.loc[np.isin(m_data.index.year, selected_years), selected_stocks]
+
+    # Newest months first; only the rows asked for are coloured and sent to the browser.
+    if len(f_m) > MONTHLY_ROWS_DEFAULT:
+        n_rows = st.slider("Months shown", 12, len(f_m), MONTHLY_ROWS_DEFAULT)
+        f_m    = f_m.iloc[:n_rows]
+    f_m.index = f_m.index.strftime("%Y-%b")
+    render_heatmap(f_m)
+
+with t3:
+    render_monthly_tab()
 
 
 # ══════════════════════════════════════════════
@@ -520,56 +799,43 @@ with t3:
 # ══════════════════════════════════════════════
 with t4:
     st.subheader("Quarterly Returns (%)")
-    q_data = load_sheet(file_path, SHEET_QUARTERLY)
-    if q_data is not None:
-        q_data = apply_name_map(q_data, name_map)
-        q_data.index = parse_quarterly_index(q_data.index)
-        q_data = q_data[q_data.index.notna()]
+    q_data = load_quarterly(file_path, file_version)
 
-        cols_avail = [c for c in selected_stocks if c in q_data.columns]
-        if cols_avail:
-            f_q = q_data[q_data.index.year.isin(selected_years)][cols_avail].sort_index(ascending=False)
-
-            # FIX #2: Cap the expected quarter grid at the CURRENT quarter — never show future quarters.
-            # e.g. if today is in Q1 2026, grid ends at Q1 2026, not Q4 2026.
-            today_quarter_start = current_quarter_start()
-            grid_end = min(
-                pd.Timestamp(year=max(selected_years), month=10, day=1),  # Q4 start of max year
-                today_quarter_start,                                        # current quarter start
-            )
+    f_q = q_data.loc[np.isin(q_data.index.year, selected_years), selected_stocks]
 
-            expected_quarters = pd.period_range(
-                start=f"{min(selected_years)}Q1",
-                end=pd.Period(grid_end, freq="Q"),
-                freq="Q",
-            )
-            expected_idx = expected_quarters.to_timestamp()
-            f_q = f_q.reindex(expected_idx.sort_values(ascending=False))
-            f_q.index = f_q.index.to_period("Q").astype(str)
-
-            st.dataframe(
-                f_q.style
-                    .background_gradient(cmap="RdYlGn", axis=None)
-                    .format("{:.2f}%", na_rep="—"),
-                use_container_width=True,
-            )
-            missing_count = f_q.isna().all(axis=1).sum()
-            if missing_count:
-                st.caption(f"ℹ️ {missing_count} quarter(s) show '—' because no data exists in the source file for those periods.")
-        else:
-            st.info("ℹ️ No matching tickers in quarterly_returns sheet.")
-    else:
-        st.info("ℹ️ Quarterly data not found.")
+    # FIX #2: Cap the expected quarter grid at the CURRENT quarter — never show future quarters.
+    # e.g. if today is in Q1 2026, grid ends at Q1 2026, not Q4 2026.
+    today_quarter_start = current_quarter_start()
+    grid_end = min(
+        pd.Timestamp(year=max(selected_years), month=10, day=1),  # Q4 start of max year
+        today_quarter_start,                                        # current quarter start
+    )
+
+    expected_quarters = pd.period_range(
+        start=f"{min(selected_years)}Q1",
+        end=pd.Period(grid_end, freq="Q"),
+        freq="Q",
+    )
+    expected_idx = expected_quarters.to_timestamp()
+    f_q = f_q.reindex(expected_idx.sort_values(ascending=False))
+    f_q.index = f_q.index.to_period("Q").astype(str)
+
+    render_heatmap(f_q)
+    missing_count = f_q.isna().all(axis=1).sum()
+    if missing_count:
+        st.caption(f"ℹ️ {missing_count} quarter(s) show '—' because there is no price data for those quarters.")
 
 
 # ══════════════════════════════════════════════
 # TAB 5 — DAILY HEATMAP
 # ══════════════════════════════════════════════
-with t5:
-    available_months = sorted(
-        prices_df[prices_df.index.year.isin(selected_years)].index.strftime("%Y-%m").unique().tolist(),
-        reverse=True,
-    )
+@st.fragment
+def render_daily_tab():
+    """Month / chart-stock pickers rerun only this tab, not the figures in Tabs 1–4."""
+    available_months = [
+        f"{c // 100:04d}-{c % 100:02d}"
+        for c in month_codes[np.isin(month_codes // 100, selected_years)]
+    ]
     default_month = [available_months[0]] if available_months else []
     sel_months    = st.multiselect(
         "📅 Select Month(s) to Analyse",
@@ -585,36 +851,41 @@ with t5:
     else:
         with st.spinner("Crunching daily returns…"):
             try:
-                target_indices = prices_df[
-                    prices_df.index.strftime("%Y-%m").isin(sel_months)
-                ].index
+                date_labels    = load_date_labels(file_path, file_version)
+                sel_codes      = [int(m.replace("-", "")) for m in sel_months]
+                target_rows    = np.flatnonzero(date_labels["ym"].isin(sel_codes))
+                target_labels  = date_labels.iloc[target_rows]
+                target_indices = target_labels.index
 
                 if target_indices.empty:
                     st.warning("⚠️ No data found for the selected months.")
                 else:
-                    daily_ret_full = (
-                        prices_df[selected_stocks]
-                        .loc[:target_indices[-1]]
-                        .pct_change() * 100
-                    )
-                    day_view = daily_ret_full.loc[target_indices].copy()
-
+                    # Positional row take — only the selected months are copied out of the shared frame.
+                    day_view = load_daily_returns(file_path, file_version).iloc[target_rows][selected_stocks]
+
+                    # One contiguous float32 array: per-stock stats and the best/worst cell in single passes.
+                    arr     = np.ascontiguousarray(day_view.to_numpy(dtype=np.float32))
+                    n_valid = (~np.isnan(arr)).sum(axis=0)
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        avg_move = np.nansum(arr, axis=0) / n_valid
                     summary_df = pd.DataFrame({
-                        "Total Return (%)":   ((1 + day_view / 100).prod() - 1) * 100,
-                        "Best Day (%)":       day_view.max(),
-                        "Worst Day (%)":      day_view.min(),
-                        "Avg Daily Move (%)": day_view.mean(),
-                    }).sort_values("Total Return (%)", ascending=False)
+                        "Total Return (%)":   (np.nanprod(1 + arr / 100, axis=0) - 1) * 100,
+                        "Best Day (%)":       np.fmax.reduce(arr, axis=0),
+                        "Worst Day (%)":      np.fmin.reduce(arr, axis=0),
+                        "Avg Daily Move (%)": avg_move,
+                    }, index=day_view.columns).sort_values("Total Return (%)", ascending=False)
 
                     top_2_names    = summary_df.head(2).index.tolist()
                     overall_winner = summary_df.index[0]
                     overall_val    = summary_df.iloc[0]["Total Return (%)"]
-                    max_val        = day_view.max().max()
-                    best_s         = day_view.max().idxmax()
-                    best_d         = day_view[best_s].idxmax().strftime("%d %b %Y")
-                    min_val        = day_view.min().min()
-                    worst_s        = day_view.min().idxmin()
-                    worst_d        = day_view[worst_s].idxmin().strftime("%d %b %Y")
+                    best_r, best_c   = np.unravel_index(np.where(np.isnan(arr), -np.inf, arr).argmax(), arr.shape)
+                    worst_r, worst_c = np.unravel_index(np.where(np.isnan(arr), np.inf, arr).argmin(), arr.shape)
+                    max_val        = arr[best_r, best_c]
+                    best_s         = day_view.columns[best_c]
+                    best_d         = day_view.index[best_r].strftime("%d %b %Y")
+                    min_val        = arr[worst_r, worst_c]
+                    worst_s        = day_view.columns[worst_c]
+                    worst_d        = day_view.index[worst_r].strftime("%d %b %Y")
 
                     ti1, ti2, ti3 = st.columns(3)
                     ti1.metric("🥇 Period Leader",   f"{overall_val:.2f}%", overall_winner)
@@ -642,30 +913,30 @@ with t5:
                     with chart_col:
                         if sel_stocks_chart:
                             st.subheader(f"🕵️ Compounded Growth ({', '.join(sel_months)})")
-                            chart_data    = day_view[sel_stocks_chart].copy()
-                            cum_trend_pct = ((1 + chart_data / 100).cumprod() - 1) * 100
+                            chart_vals    = day_view[sel_stocks_chart].to_numpy()
+                            growth        = np.nancumprod(1 + chart_vals / 100, axis=0)
+                            growth[np.isnan(chart_vals)] = np.nan   # same gaps as pandas' skipna cumprod
+                            cum_trend_pct = pd.DataFrame(
+                                (growth - 1) * 100, index=day_view.index, columns=sel_stocks_chart,
+                            )
                             fig_trend     = px.line(
                                 cum_trend_pct, template="plotly_white",
                                 labels={"value": "Growth %", "index": "Date"},
-                                markers=True, height=450,
+                                markers=True, height=450, render_mode="webgl",
                             )
                             fig_trend.add_hline(y=0, line_dash="dash", line_color="gray", opacity=0.7)
                             fig_trend.update_layout(hovermode="x unified", margin=dict(l=0, r=0, t=10, b=0))
                             st.plotly_chart(fig_trend, use_container_width=True)
 
                     st.subheader("📋 Raw Daily Returns (%)")
-                    table_display = day_view.copy().sort_index(ascending=False)
-                    table_display.index = table_display.index.strftime("%Y-%m-%d (%a)")
-                    st.dataframe(
-                        table_display.style
-                            .background_gradient(cmap="RdYlGn", axis=None)
-                            .format("{:.2f}%"),
-                        use_container_width=True,
-                    )
+                    table_display = day_view.copy()
+                    table_display.index = target_labels["day"].to_numpy()
+                    table_display = table_display.iloc[::-1]
+                    render_heatmap(table_display)
 
                     st.subheader("📈 Absolute Price History (Selected Period)")
-                    period_prices = prices_df.loc[target_indices, selected_stocks].copy()
-                    period_prices.index = period_prices.index.strftime("%Y-%m-%d")
+                    period_prices = prices_df.iloc[target_rows, prices_df.columns.get_indexer(selected_stocks)]
+                    period_prices.index = target_labels["date"].to_numpy()
                     st.dataframe(period_prices.sort_index(ascending=False), use_container_width=True)
 
                     month_key = "_".join(sel_months)
@@ -674,7 +945,7 @@ with t5:
                     with dl1:
                         st.download_button(
                             "📥 Download Daily Returns (CSV)",
-                            data=day_view.to_csv().encode("utf-8"),
+                            data=csv_bytes(day_view),
                             file_name=f"returns_{month_key}.csv",
                             mime="text/csv",
                             use_container_width=True,
@@ -683,7 +954,7 @@ with t5:
                     with dl2:
                         st.download_button(
                             "📥 Download Price History (CSV)",
-                            data=period_prices.to_csv().encode("utf-8"),
+                            data=csv_bytes(period_prices),
                             file_name=f"prices_{month_key}.csv",
                             mime="text/csv",
                             use_container_width=True,
@@ -694,10 +965,16 @@ with t5:
                 st.error(f"⚠️ Tab 5 Error: {e}")
 
 
+with t5:
+    render_daily_tab()
+
+
 # ══════════════════════════════════════════════
 # TAB 6 — DEEP-DIVE
 # ══════════════════════════════════════════════
-with t6:
+@st.fragment
+def render_deep_dive_tab():
+    """Stock / compare pickers rerun only this tab, not the figures in Tabs 1–5."""
     st.subheader("🔍 Individual Stock Deep-Dive")
 
     dd_col1, dd_col2 = st.columns([2, 1])
@@ -710,11 +987,12 @@ with t6:
 
     if target_stock:
         with st.spinner(f"Loading analysis for {target_stock}…"):
-            s_data      = filtered_prices[target_stock].dropna()
-            full_series = prices_df[target_stock].dropna()
+            s_data  = filtered_prices[target_stock].dropna()
+            history = load_moving_averages(file_path, file_version, target_stock)
 
-            ma50  = full_series.rolling(50).mean().reindex(s_data.index)
-            ma200 = full_series.rolling(200).mean().reindex(s_data.index)
+            mas   = history.reindex(s_data.index)
+            ma50  = mas["ma50"]
+            ma200 = mas["ma200"]
 
             ma50_valid  = ma50.dropna()
             ma200_valid = ma200.dropna()
@@ -741,8 +1019,8 @@ with t6:
                     "Extend your year filter to enable MA signals."
                 )
 
-            dd_period  = (s_data / s_data.cummax() - 1) * 100
-            dd_alltime = (full_series / full_series.cummax() - 1) * 100
+            dd_period  = drawdown_pct(s_data)
+            dd_alltime = history["drawdown"]
 
             daily_ret_stock = s_data.pct_change().dropna()
             period_vol      = daily_ret_stock.std() * np.sqrt(252) * 100
@@ -754,25 +1032,29 @@ with t6:
             c4.metric("Period Max Drawdown",   f"{dd_period.min():.2f}%",    delta_color="inverse")
             c5.metric("All-Time Max Drawdown", f"{dd_alltime.min():.2f}%",   delta_color="inverse")
 
+            # Every trace is LTTB-thinned; the metrics and the peak annotation use the full series.
+            plot_px  = thin_series(s_data)
             fig_main = go.Figure()
-            fig_main.add_trace(go.Scatter(
-                x=s_data.index, y=s_data,
+            fig_main.add_trace(go.Scattergl(
+                x=plot_px.index, y=plot_px,
                 name=target_stock, line=dict(color=BRAND_DARK, width=2),
             ))
             if not ma50_valid.empty:
-                fig_main.add_trace(go.Scatter(
-                    x=ma50.index, y=ma50, name="50 DMA",
+                plot_ma50 = thin_series(ma50)
+                fig_main.add_trace(go.Scattergl(
+                    x=plot_ma50.index, y=plot_ma50, name="50 DMA",
                     line=dict(dash="dash", color="orange", width=1.5),
                 ))
             if not ma200_valid.empty:
-                fig_main.add_trace(go.Scatter(
-                    x=ma200.index, y=ma200, name="200 DMA",
+                plot_ma200 = thin_series(ma200)
+                fig_main.add_trace(go.Scattergl(
+                    x=plot_ma200.index, y=plot_ma200, name="200 DMA",
                     line=dict(dash="dot", color="red", width=1.5),
                 ))
             if compare_stock and compare_stock in filtered_prices.columns:
                 cs_data = filtered_prices[compare_stock].dropna()
-                cs_scaled = cs_data / cs_data.iloc[0] * s_data.iloc[0]
-                fig_main.add_trace(go.Scatter(
+                cs_scaled = thin_series(cs_data / cs_data.iloc[0] * s_data.iloc[0])
+                fig_main.add_trace(go.Scattergl(
                     x=cs_scaled.index, y=cs_scaled,
                     name=f"⚖️ {compare_stock} (scaled)",
                     line=dict(color="#9b59b6", width=1.5, dash="dashdot"),
@@ -785,19 +1067,22 @@ with t6:
                 template="plotly_white",
                 title=f"{target_stock} — Technical Trend",
                 hovermode="x unified",
+                uirevision=target_stock,
             )
             st.plotly_chart(fig_main, use_container_width=True)
 
             col_l, col_r = st.columns(2)
             with col_l:
+                plot_dd_period  = thin_series(dd_period)
+                plot_dd_alltime = thin_series(dd_alltime)
                 fig_dd = go.Figure()
-                fig_dd.add_trace(go.Scatter(
-                    x=dd_period.index, y=dd_period,
+                fig_dd.add_trace(go.Scattergl(
+                    x=plot_dd_period.index, y=plot_dd_period,
                     fill="tozeroy", name="Period Drawdown",
                     line=dict(color="#ff4b4b"),
                 ))
-                fig_dd.add_trace(go.Scatter(
-                    x=dd_alltime.index, y=dd_alltime,
+                fig_dd.add_trace(go.Scattergl(
+                    x=plot_dd_alltime.index, y=plot_dd_alltime,
                     name="All-Time Drawdown",
                     line=dict(color="#c0392b", dash="dot", width=1),
                 ))
@@ -836,3 +1121,7 @@ with t6:
                     st.plotly_chart(fig_corr, use_container_width=True)
             else:
                 st.info("ℹ️ Select 2 or more stocks to enable correlation analysis.")
+
+
+with t6:
+    render_deep_dive_tab()
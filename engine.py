@@ -1,6 +1,7 @@
 import json, yfinance as yf, pandas as pd, os
 from openpyxl import load_workbook
 from openpyxl.formatting.rule import ColorScaleRule
+from workbook_cache import workbook_version, write_sidecars
 
 def main():
     with open("config.json") as f:
@@ -29,19 +30,27 @@ def main():
             data = raw['Close'] if isinstance(raw.columns, pd.MultiIndex) else raw['Close'].to_frame(name=stocks[0])
             data = data.ffill()
 
+            rolling = data.pct_change(periods=252).dropna() * 100
+            meta    = pd.Series(name_map).to_frame()
             with pd.ExcelWriter(path, engine="openpyxl") as writer:
                 data.to_excel(writer, sheet_name="prices")
                 (data.resample("ME").last().pct_change() * 100).sort_index(ascending=False).to_excel(writer, sheet_name="monthly_returns")
                 (data.resample("QE").last().pct_change() * 100).sort_index(ascending=False).to_excel(writer, sheet_name="quarterly_returns")
-                (data.pct_change(periods=252).dropna() * 100).to_excel(writer, sheet_name="rolling_12m")
+                rolling.to_excel(writer, sheet_name="rolling_12m")
                 # Save the Auto-Fetched Names
-                pd.Series(name_map).to_excel(writer, sheet_name="metadata")
+                meta.to_excel(writer, sheet_name="metadata")
             
             wb = load_workbook(path)
             rule = ColorScaleRule(start_type="num", start_value=-15, start_color="F8696B", mid_type="num", mid_value=0, mid_color="FFFFFF", end_type="num", end_value=15, end_color="63BE7B")
             for s in ["monthly_returns", "quarterly_returns"]:
                 if s in wb.sheetnames: wb[s].conditional_formatting.add("B2:Z100", rule)
             wb.save(path)
+            # Sidecars the dashboard reads first. Only speeds up local runs: the workflow
+            # commits just the xlsx and .cache is gitignored. Monthly/quarterly returns
+            # are recomputed from prices by the dashboard.
+            try:
+                write_sidecars(path, workbook_version(path), {"prices": data, "rolling_12m": rolling, "metadata": meta})
+            except Exception as e: print(f"⚠️ Cache write skipped {name} (xlsx saved): {e}")
             print(f"✅ Success: {name}")
         except Exception as e: print(f"🚨 Error {name}: {e}")
 
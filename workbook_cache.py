@@ -0,0 +1,78 @@
+"""Parquet sidecars of the dashboard workbooks, shared by engine.py and dashboard.py.
+
+Each workbook gets its own folder, <folder>/.cache/<name>/, holding one
+<sheet>.<version>.parquet file per sheet, where <version> is workbook_version()
+of the xlsx the sheets came from. Kept free of Streamlit so the engine can import it.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+
+CACHE_DIRNAME = ".cache"
+SHEET_PRICES  = "prices"   # written last, so its presence marks a complete set
+
+def workbook_version(file_path: str) -> str:
+    """Content key of a workbook: its size plus a hash of the first and last 64 KB.
+
+    An xlsx is a zip whose central directory (CRC and size of every part) sits at the
+    end, so any edit changes the tail, while re-copying identical bytes — a new mtime
+    but the same data — keeps every cache entry and sidecar valid.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        head = f.read(65536)
+        f.seek(max(size - 65536, 0))
+        tail = f.read()
+    return f"{size:x}{hashlib.blake2b(head + tail, digest_size=8).hexdigest()}"
+
+def sidecar_suffix(version: str) -> str:
+    """Version tag of a sidecar file, as returned by workbook_version()."""
+    return f".{version}.parquet"
+
+def sidecar_dir(file_path: str) -> str:
+    """Per-workbook cache folder, so one workbook's globs never match another's files."""
+    folder, name = os.path.split(os.path.splitext(file_path)[0])
+    return os.path.join(folder, CACHE_DIRNAME, name)
+
+def read_sidecars(file_path: str, version: str) -> dict[str, pd.DataFrame] | None:
+    """Sheets previously converted from this exact workbook version, or None if the set
+    is missing, incomplete or damaged."""
+    suffix = sidecar_suffix(version)
+    paths  = glob.glob(os.path.join(glob.escape(sidecar_dir(file_path)), f"*{suffix}"))
+    try:
+        # Arrow decodes with the GIL released, so the per-sheet reads overlap on multi-core hosts.
+        with ThreadPoolExecutor(max_workers=max(len(paths), 1)) as pool:
+            frames = list(pool.map(pd.read_parquet, paths))
+    except (OSError, pa.ArrowException):
+        return None   # damaged or just-removed sidecar — callers re-parse the xlsx
+    book = {
+        os.path.basename(p)[:-len(suffix)]: df
+        for p, df in zip(paths, frames)
+    }
+    return book if SHEET_PRICES in book else None
+
+def write_sidecars(file_path: str, version: str, sheets: dict[str, pd.DataFrame]) -> None:
+    """Stores each sheet as Parquet and drops sidecars of older versions; raises OSError
+    if the cache folder isn't writable."""
+    folder = sidecar_dir(file_path)
+    os.makedirs(folder, exist_ok=True)
+    for old in glob.glob(os.path.join(glob.escape(folder), "*.parquet")):
+        os.remove(old)
+    for sheet, df in sorted(sheets.items(), key=lambda kv: kv[0] == SHEET_PRICES):
+        df = df.rename_axis(columns=None)
+        df.columns = df.columns.astype(str)   # Parquet requires string column names
+        # Write under a temporary name and rename into place, so a process killed
+        # mid-write never leaves a truncated file under a name the reader trusts.
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+        os.close(fd)
+        try:
+            df.to_parquet(tmp, engine="pyarrow", compression="zstd")
+            os.replace(tmp, os.path.join(folder, f"{sheet}{sidecar_suffix(version)}"))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)